@@ -1,103 +1,433 @@
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, jsonify, abort, make_response, send_from_directory, send_file, g, url_for
+from werkzeug.security import safe_join
+from werkzeug.http import is_resource_modified
 from dotenv import load_dotenv
-import os, sqlite3, datetime
-
-from linebot.v3.messaging import (
-    MessagingApi,
-    MessagingApiBlob,
-    Configuration,
-    ApiClient,
-    ReplyMessageRequest,
-    TextMessage
-)
+import os, datetime, time, hashlib, mimetypes, uuid, logging, contextvars, atexit
+from concurrent.futures import ThreadPoolExecutor
+
+# โหลด .env (ก่อน import module ของแอปที่อ่านค่าตั้งแต่ตอน import)
+load_dotenv()
+
+from logs import setup_logging, request_id
+setup_logging()
+
+import storage
+import metrics
+import profiler
+from event_queue import EventQueue
+from image_store import get_store, content_hash, IMAGE_DIR, IMAGE_STORE
+from thumbnails import ThumbnailPipeline, THUMB_DIR, THUMBNAILS
+from idempotency import IdempotencyIndex, event_key
+import line_client
+
+from linebot.v3.messaging import TextMessage
 from linebot.v3.webhook import WebhookHandler
 from linebot.v3.webhooks import MessageEvent, TextMessageContent, ImageMessageContent
 from linebot.v3.exceptions import InvalidSignatureError
 
-# โหลด .env
-load_dotenv()
+logger = logging.getLogger("linebot.app")
+
 CHANNEL_SECRET = os.getenv("CHANNEL_SECRET")
 CHANNEL_ACCESS_TOKEN = os.getenv("CHANNEL_ACCESS_TOKEN")
 
-# LINE Bot SDK
-configuration = Configuration(access_token=CHANNEL_ACCESS_TOKEN)
-api_client = ApiClient(configuration)
-line_bot_api = MessagingApi(api_client)
-line_bot_blob = MessagingApiBlob(api_client)
+# โหมด async: /callback ตรวจ signature แล้วโยน event เข้าคิว ตอบ 200 ทันที
+# คิวอยู่ในหน่วยความจำ: ตอนปิด worker (deploy, max_requests, SIGTERM) จะรอให้คิวว่างได้ไม่เกิน WEBHOOK_DRAIN_TIMEOUT
+# (gunicorn.conf.py / atexit) body ที่ยังค้างหลังจากนั้นหายไปเลย เพราะ LINE ได้ 200 แล้วจึงไม่ส่งซ้ำ (ดู log "bodies lost")
+ASYNC_WEBHOOK = os.getenv("ASYNC_WEBHOOK", "0") == "1"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# reply token ใช้ได้ในเวลาจำกัดหลังเกิด event ถ้าเลยแล้วให้บันทึกข้อมูลอย่างเดียว ไม่ต้อง reply
+REPLY_TOKEN_TTL = float(os.getenv("REPLY_TOKEN_TTL", "50"))
+# webhook ที่มีหลายรูปใน body เดียว: โหลดรูปพร้อมกันผ่าน aiohttp
+LINE_ASYNC_DOWNLOAD = os.getenv("LINE_ASYNC_DOWNLOAD", "1") == "1"
+
+# LINE Bot SDK (client ตั้งค่าอยู่ใน line_client.py)
 handler = WebhookHandler(CHANNEL_SECRET)
 
+# การส่งไฟล์รูป: ให้ proxy ด้านหน้าส่ง bytes แทน worker
+# IMAGE_ACCEL_REDIRECT=/protected/images/ (nginx internal location) หรือ USE_X_SENDFILE=1 (Apache/lighttpd)
+IMAGE_ACCEL_REDIRECT = os.getenv("IMAGE_ACCEL_REDIRECT")
+
+# /debug/profile (sampling profiler) เปิดเฉพาะเมื่อ PROFILER=1
+PROFILER = os.getenv("PROFILER", "0") == "1"
+
 # Flask App
 app = Flask(__name__)
-os.makedirs("static/images", exist_ok=True)
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "0") == "1"
+image_store = get_store()
+app.jinja_env.globals["image_url"] = image_store.url
+thumbnail_pipeline = ThumbnailPipeline(storage.set_derivatives, storage.mark_thumb_failed)
+if THUMBNAILS and IMAGE_STORE == "s3":
+    # thumbnail สร้างจากไฟล์บนดิสก์เท่านั้น (เก็บไว้ใน THUMB_DIR ในเครื่อง) รูปบน S3 จึงแสดงเป็นรูปเต็มขนาดใน dashboard
+    logger.warning("IMAGE_STORE=s3: thumbnails are not generated for S3 images, "
+                   "the dashboard embeds full-size originals")
+# thumbnail ตั้งชื่อตาม hash ของรูป เนื้อหาไม่เปลี่ยน จึง cache ได้นาน
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
 
 # DB Init
-def init_db():
-    conn = sqlite3.connect("database.db")
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS records (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT,
-        text TEXT,
-        image_path TEXT,
-        timestamp TEXT
-    )''')
-    conn.commit()
-    conn.close()
-
-init_db()
+storage.init_db()
+
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = 200
+
+def query_page():
+    args = request.args
+    for key in ("from", "to"):
+        if args.get(key):
+            try:
+                datetime.date.fromisoformat(args[key])
+            except ValueError:
+                abort(400, f"invalid '{key}' date, expected YYYY-MM-DD")
+    try:
+        limit = min(max(int(args.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        return storage.query_records(
+            user_id=args.get("user_id"),
+            date_from=args.get("from"),
+            date_to=args.get("to"),
+            cursor=args.get("cursor"),
+            limit=limit,
+        )
+    except ValueError as e:
+        abort(400, str(e))
+
+def conditional(rows, next_cursor, render):
+    # ETag จากเนื้อหาของหน้านี้: refresh หน้าที่ไม่เปลี่ยนจะได้ 304 โดยไม่ต้อง render
+    # ไม่ส่ง Last-Modified: timestamp ละเอียดแค่วินาที และไม่เปลี่ยนเมื่อ thumb_path ถูกเขียนทีหลัง
+    etag = hashlib.sha1(repr((request.full_path, rows, next_cursor)).encode()).hexdigest()
+    if is_resource_modified(request.environ, etag=etag):
+        resp = make_response(render())
+    else:
+        resp = make_response("", 304)
+    resp.set_etag(etag)
+    resp.cache_control.no_cache = True
+    return resp
+
+def thumb_url(path):
+    # path ใน DB อยู่ใต้ THUMB_DIR (relative หรือ absolute ก็ได้) เสิร์ฟผ่าน /thumbs/
+    return url_for("thumbs", filename=os.path.relpath(path, THUMB_DIR))
+
+app.jinja_env.globals["thumb_url"] = thumb_url
 
 @app.route('/')
 def index():
-    conn = sqlite3.connect("database.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM records ORDER BY id DESC")
-    rows = c.fetchall()
-    conn.close()
-    return render_template("index.html", rows=rows)
+    rows, next_cursor = query_page()
+    # backfill แบบ lazy: แถวเก่าที่ยังไม่มี thumbnail จะถูกสร้างเมื่อมีคนเปิดหน้านั้น
+    # (ข้ามไฟล์ที่หายไปแล้ว และแถวที่เคยสร้างไม่สำเร็จ ซึ่ง thumb_path = THUMB_FAILED)
+    for row in rows:
+        if row[3] and row[5] is None and os.path.isfile(row[3]):
+            thumbnail_pipeline.submit(row[3])
+    return conditional(rows, next_cursor, lambda: render_template(
+        "index.html", records=rows, next_cursor=next_cursor, args=request.args))
+
+@app.route('/api/records')
+def api_records():
+    rows, next_cursor = query_page()
+    keys = ("id", "user_id", "text", "image_path", "timestamp", "thumb_path", "webp_path")
+    return conditional(rows, next_cursor, lambda: jsonify(
+        records=[dict(zip(keys, r)) for r in rows], next_cursor=next_cursor))
+
+def hidden_path(filename):
+    # ไฟล์/directory ที่ขึ้นต้นด้วย "." เป็นไฟล์ชั่วคราวที่ยังเขียนไม่เสร็จ (safe_join ไม่กันให้)
+    return any(part.startswith(".") for part in filename.split("/"))
+
+@app.route('/images/<path:filename>')
+def images(filename):
+    # path สัมพัทธ์กับ working directory (ที่เขียนไฟล์) ไม่ใช่ root ของ Flask app
+    path = safe_join(os.path.abspath(IMAGE_DIR), filename)
+    if path is None or hidden_path(filename) or not os.path.isfile(path):
+        abort(404)
+    # ชื่อไฟล์คือ sha256 ของเนื้อหา: ใช้เป็น strong ETag และ cache ได้ถาวร
+    sha256 = content_hash(path)
+    if IMAGE_ACCEL_REDIRECT:
+        if sha256 and not is_resource_modified(request.environ, etag=sha256):
+            resp = make_response("", 304)
+        else:
+            resp = make_response("")
+            resp.headers["X-Accel-Redirect"] = IMAGE_ACCEL_REDIRECT.rstrip("/") + "/" + filename
+            resp.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    else:
+        # conditional=True: รองรับ Range / If-None-Match; ใต้ gunicorn จะใช้ sendfile ผ่าน wsgi.file_wrapper
+        resp = send_file(path, etag=sha256 or True, conditional=True,
+                         max_age=IMMUTABLE_MAX_AGE if sha256 else None)
+    if sha256:
+        resp.set_etag(sha256)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = IMMUTABLE_MAX_AGE
+        resp.cache_control.immutable = True
+    return resp
+
+@app.route('/thumbs/<path:filename>')
+def thumbs(filename):
+    if hidden_path(filename):
+        abort(404)
+    resp = send_from_directory(os.path.abspath(THUMB_DIR), filename, max_age=IMMUTABLE_MAX_AGE)
+    resp.cache_control.immutable = True
+    return resp
+
+@app.before_request
+def assign_request_id():
+    # ใช้ X-Request-Id จาก proxy ถ้ามี ไม่งั้นสร้างใหม่; ติดไปกับทุก log ของ request นี้
+    g.request_id_token = request_id.set(request.headers.get("X-Request-Id") or uuid.uuid4().hex[:16])
+
+@app.after_request
+def add_request_id(resp):
+    resp.headers["X-Request-Id"] = request_id.get()
+    return resp
+
+@app.teardown_request
+def reset_request_id(exc):
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        request_id.reset(token)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+def float_arg(name, default, low, high):
+    try:
+        value = float(request.args.get(name, default))
+    except ValueError:
+        abort(400, f"'{name}' must be a number")
+    if not low <= value <= high:
+        abort(400, f"'{name}' must be between {low} and {high}")
+    return value
+
+if PROFILER:
+    @app.route('/debug/profile')
+    def debug_profile():
+        seconds = float_arg("seconds", 5, 0.01, 60)
+        interval = float_arg("interval", 0.005, 0.001, 1)
+        try:
+            folded = profiler.sample(seconds, interval)
+        except RuntimeError as e:
+            abort(409, str(e))
+        return folded, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.cli.command("backfill-thumbnails")
+def backfill_thumbnails():
+    """Generate thumbnails for every stored image that has none yet."""
+    done = set()
+    while True:
+        paths = [p for p in storage.images_missing_thumbs() if p not in done]
+        if not paths:
+            break
+        for path in paths:
+            done.add(path)
+            thumbnail_pipeline.submit(path)
+        thumbnail_pipeline.wait()
+    print(f"✅ {len(done)} images processed")
+
+@app.route('/queue/stats')
+def queue_stats():
+    return jsonify(event_queue.stats())
+
+@app.route('/idempotency/stats')
+def idempotency_stats():
+    return jsonify(idempotency.stats())
 
 @app.route('/callback', methods=['POST'])
 def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
 
+    start = time.perf_counter()
     try:
-        handler.handle(body, signature)
+        events = handler.parser.parse(body, signature)
+        logger.info("webhook received", extra={"events": len(events)})
+        if ASYNC_WEBHOOK:
+            # ทั้ง body เป็นงานเดียวในคิว; คิวเต็มก็ประมวลผลใน request นี้เลย (backpressure)
+            for batch in event_queue.submit([events]):
+                process_batch(batch)
+        else:
+            process_batch(events)
+        status = 200
     except InvalidSignatureError:
-        return 'Invalid signature', 400
-    except Exception as e:
-        print(f"🔥 Error: {e}")
-        return 'Error', 500
+        logger.warning("invalid signature")
+        status = 400
+    except Exception:
+        logger.exception("🔥 Error")
+        metrics.errors_total.inc("callback")
+        status = 500
+    metrics.stage_seconds.observe(time.perf_counter() - start, "callback")
+    metrics.webhook_requests_total.inc(status)
+    return {200: 'OK', 400: 'Invalid signature', 500: 'Error'}[status], status
+
+def process_batch(events):
+    """Handle all events of one webhook body, skipping ones already processed.
+
+    The idempotency check runs before anything is downloaded, so a
+    redelivered body costs one lookup per event.
+    """
+    claimed = []
+    fresh = []
+    for event in events:
+        if not isinstance(event, MessageEvent):
+            continue
+        key = event_key(event)
+        if idempotency.claim(key):
+            claimed.append(key)
+            fresh.append(event)
+        else:
+            metrics.events_total.inc(message_type(event), "duplicate")
+            logger.info("duplicate event skipped", extra={"webhook_event_id": event.webhook_event_id})
+    committed = []
+    try:
+        with metrics.timer("batch"):
+            committed = process_events(fresh)
+    finally:
+        idempotency.release(claimed, committed)
 
-    return 'OK', 200
+def message_type(event):
+    return getattr(event.message, "type", None) or "unknown"
+
+def process_events(events):
+    """Images are downloaded concurrently, every row is written in one
+    transaction and replies go out in parallel. A failing event is logged
+    and answered on its own; only a failed DB write fails the whole body
+    (so LINE redelivers it). Returns the idempotency keys committed.
+    """
+    staged = prefetch_images(events)
+    stored = {}
+    records, images, keys, replies = [], [], [], []
+    try:
+        for event in events:
+            try:
+                prepared = prepare_message(event, staged.pop(getattr(event.message, "id", None), None), stored)
+            except Exception:
+                logger.exception("🔥 Event error", extra={"webhook_event_id": event.webhook_event_id})
+                metrics.events_total.inc(message_type(event), "error")
+                replies.append((event, "❌ บันทึกไม่สำเร็จ กรุณาส่งใหม่อีกครั้ง"))
+                continue
+            if prepared:
+                record, image, text = prepared
+                records.append(record)
+                keys.append(event_key(event))
+                if image:
+                    images.append(image)
+                replies.append((event, text))
+                metrics.events_total.inc(message_type(event), "ok")
+    finally:
+        # ไฟล์ชั่วคราวของรูปที่โหลดมาแล้วแต่ไม่ได้ใช้
+        for item in staged.values():
+            if not isinstance(item, Exception):
+                image_store.discard(item)
+
+    with metrics.timer("db_write"):
+        storage.save_batch(records, images, keys)
+    for record in records:
+        if record[2]:
+            thumbnail_pipeline.submit(record[2])
+    send_replies(replies)
+    return keys
+
+def prefetch_images(events):
+    # message id ซ้ำใน body เดียวโหลดครั้งเดียว (ไม่งั้นไฟล์ชั่วคราวของตัวแรกจะถูกทับแล้วค้างอยู่)
+    msg_ids = list(dict.fromkeys(e.message.id for e in events
+                                 if isinstance(e, MessageEvent) and isinstance(e.message, ImageMessageContent)))
+    if not LINE_ASYNC_DOWNLOAD or len(msg_ids) < 2:
+        return {}
+    return dict(zip(msg_ids, line_client.async_downloader.download_many(msg_ids, image_store.astage)))
+
+event_queue = EventQueue(process_batch, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE)
+# นอก gunicorn (flask run / python) ไม่มี worker_exit hook: drain ตอน interpreter ปิดแทน
+atexit.register(event_queue.stop)
+idempotency = IdempotencyIndex()
+metrics.register(metrics.Stats("linebot_queue", event_queue.stats, counters={
+    "enqueued": ("enqueued_total", "Webhook bodies put on the queue."),
+    "processed": ("processed_total", "Queued bodies processed."),
+    "failed": ("failed_total", "Queued bodies that raised."),
+    "rejected": ("rejected_total", "Bodies processed inline because the queue was full."),
+    "expired_replies": ("expired_replies_total", "Replies skipped because the reply token expired."),
+    "total_wait_ms": ("wait_milliseconds_total", "Time bodies spent waiting in the queue."),
+}, gauges={
+    "depth": ("depth", "Bodies waiting in the queue."),
+    "capacity": ("capacity", "Maximum queue size."),
+    "max_depth": ("max_depth", "Highest queue depth seen."),
+    "max_wait_ms": ("max_wait_milliseconds", "Longest queue wait seen."),
+}))
+metrics.register(metrics.Stats("linebot_dedupe", idempotency.stats, counters={
+    "checked": ("checked_total", "Events checked against the idempotency index."),
+    "cache_hits": ("cache_hits_total", "Duplicates found in the in-process cache."),
+    "db_hits": ("db_hits_total", "Duplicates found in processed_events."),
+    "in_flight_hits": ("in_flight_hits_total", "Duplicates that arrived while the first copy was processing."),
+    "evicted": ("evicted_total", "Keys evicted from the in-process cache."),
+    "swept": ("swept_total", "Expired rows deleted from processed_events."),
+}, gauges={
+    "cached": ("cached", "Keys in the in-process cache."),
+    "in_flight": ("in_flight", "Events currently being processed."),
+    "hit_rate": ("hit_rate", "Share of checked events that were duplicates."),
+}))
+reply_pool = ThreadPoolExecutor(max_workers=line_client.LINE_POOL_MAXSIZE, thread_name_prefix="line-reply")
+
+def reply_text(event, text):
+    age = time.time() - event.timestamp / 1000
+    if age > REPLY_TOKEN_TTL:
+        logger.warning("⏰ Reply token expired, skip reply",
+                       extra={"webhook_event_id": event.webhook_event_id, "age_s": round(age, 1)})
+        event_queue.reply_expired()
+        return
+    line_client.reply_message(event.reply_token, [TextMessage(text=text)])
+
+def send_replies(replies):
+    if len(replies) == 1:
+        event, text = replies[0]
+        try:
+            reply_text(event, text)
+        except Exception:
+            reply_failed(event)
+        return
+    # reply thread ไม่มี context ของ request: คัดลอกไปด้วยเพื่อให้ log มี request id
+    futures = [(event, reply_pool.submit(contextvars.copy_context().run, reply_text, event, text))
+               for event, text in replies]
+    for event, fut in futures:
+        try:
+            fut.result()
+        except Exception:
+            reply_failed(event)
+
+def reply_failed(event):
+    metrics.errors_total.inc("reply")
+    logger.exception("🔥 Reply error", extra={"webhook_event_id": event.webhook_event_id})
 
 @handler.add(MessageEvent)
 def handle_message(event):
+    process_batch([event])
+
+def prepare_message(event, staged=None, stored=None):
+    """Return (record, image row or None, reply text), or None for unsupported messages."""
     user_id = event.source.user_id
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
     if isinstance(event.message, TextMessageContent):
         text = event.message.text.strip()
-        save_to_db(user_id, text, None, timestamp)
-        reply = TextMessage(text="✅ ข้อความถูกบันทึกแล้ว")
-        line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[reply]))
+        return (user_id, text, None, timestamp), None, "✅ ข้อความถูกบันทึกแล้ว"
 
     elif isinstance(event.message, ImageMessageContent):
-        msg_id = event.message.id
-        image_data = line_bot_blob.get_message_content(msg_id)
-        filename = f"static/images/{user_id}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.jpg"
-
-        with open(filename, 'wb') as f:
-            for chunk in image_data:
-                f.write(chunk)
-
-        save_to_db(user_id, None, filename, timestamp)
-        reply = TextMessage(text="📷 รูปภาพถูกบันทึกเรียบร้อย")
-        line_bot_api.reply_message(ReplyMessageRequest(reply_token=event.reply_token, messages=[reply]))
-
-def save_to_db(user_id, text, image_path, timestamp):
-    conn = sqlite3.connect("database.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO records (user_id, text, image_path, timestamp) VALUES (?, ?, ?, ?)",
-              (user_id, text, image_path, timestamp))
-    conn.commit()
-    conn.close()
+        filename, image = store_image(event.message.id, timestamp, staged, stored)
+        return (user_id, None, filename, timestamp), image, "📷 รูปภาพถูกบันทึกเรียบร้อย"
+
+def store_image(msg_id, timestamp, staged=None, stored=None):
+    """Put the image file in the image store; return (path, images row to insert or None if already known).
+
+    ``stored`` maps message ids already stored for this webhook body to their path.
+    """
+    if stored and msg_id in stored:
+        # message เดียวกันซ้ำใน body: ใช้ไฟล์ที่เพิ่งเก็บ ไม่ต้องโหลดใหม่
+        return stored[msg_id], None
+    if isinstance(staged, Exception):
+        raise staged
+    if staged is None:
+        staged = line_client.download_content(msg_id, image_store.stage)
+    path = storage.find_image(staged.sha256)
+    image = None
+    if path:
+        # รูปซ้ำ: ใช้ไฟล์เดิม ไม่ต้องเขียนใหม่
+        image_store.discard(staged)
+    else:
+        with metrics.timer("file_write"):
+            path = image_store.commit(staged)
+        image = (staged.sha256, path, staged.size, timestamp)
+    if stored is not None:
+        stored[msg_id] = path
+    return path, image
@@ -0,0 +1,107 @@
+# fake LINE Messaging API สำหรับทดสอบ/benchmark ในเครื่อง
+#   POST /v2/bot/message/reply           -> 200 {}
+#   GET  /v2/bot/message/<id>/content    -> JPEG
+# ชี้แอปมาที่นี่ด้วย LINE_API_HOST=http://127.0.0.1:<port> LINE_BLOB_HOST=http://127.0.0.1:<port>
+# ใช้: python bench/fake_line_api.py [--port 8090] [--latency-ms 0] [--fail-rate 0] [--fail-status 500] [--image-kb 200]
+# ทดสอบ: server.fail_ids = {"<message id>"} ให้ content ของ message นั้นตอบ fail_status ทุกครั้ง
+import argparse, json, os, random, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_PATH = re.compile(r"^/v2/bot/message/([^/]+)/content$")
+
+
+def make_jpeg(size_kb):
+    # JPEG header + padding: พอสำหรับ hash/เขียนไฟล์ ไม่ต้องพึ่ง Pillow
+    return b"\xff\xd8\xff\xe0" + os.urandom(max(size_kb * 1024 - 6, 0)) + b"\xff\xd9"
+
+
+class FakeLineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _delay_or_fail(self, msg_id=None):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        if msg_id in server.fail_ids or (server.fail_rate and random.random() < server.fail_rate):
+            with server.lock:
+                server.failures += 1
+            self._send(server.fail_status, b'{"message":"injected failure"}', "application/json")
+            return True
+        return False
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self._delay_or_fail():
+            return
+        if self.path == "/v2/bot/message/reply":
+            with self.server.lock:
+                self.server.replies.append(json.loads(body or b"{}"))
+            self._send(200, b"{}", "application/json")
+        else:
+            self._send(404, b'{"message":"Not found"}', "application/json")
+
+    def do_GET(self):
+        match = CONTENT_PATH.match(self.path)
+        if not match:
+            self._send(404, b'{"message":"Not found"}', "application/json")
+            return
+        if self._delay_or_fail(match.group(1)):
+            return
+        with self.server.lock:
+            self.server.downloads += 1
+            # message id เดียวกันได้รูปเดียวกัน (ใช้ทดสอบ dedupe)
+            image = self.server.images.setdefault(match.group(1), make_jpeg(self.server.image_kb))
+        self._send(200, image, "image/jpeg")
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeLineServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # client ปิด connection กลางคัน (เช่น app ถูกปิดตอนจบ benchmark) ไม่ต้องพิมพ์ traceback
+        pass
+
+
+def start_fake_line_api(port=0, latency_ms=0, fail_rate=0.0, image_kb=200, fail_status=500):
+    server = FakeLineServer(("127.0.0.1", port), FakeLineHandler)
+    server.latency = latency_ms / 1000
+    server.fail_rate = fail_rate
+    server.fail_status = fail_status
+    server.fail_ids = set()
+    server.failures = 0
+    server.image_kb = image_kb
+    server.lock = threading.Lock()
+    server.replies = []
+    server.images = {}
+    server.downloads = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--fail-rate", type=float, default=0)
+    parser.add_argument("--fail-status", type=int, default=500)
+    parser.add_argument("--image-kb", type=int, default=200)
+    args = parser.parse_args()
+    server = start_fake_line_api(args.port, args.latency_ms, args.fail_rate, args.image_kb, args.fail_status)
+    print(f"fake LINE API on {server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,124 @@
+# วัด worker occupancy ของ gunicorn (sync worker) ตอนเสิร์ฟรูป จากเวลาใน access log (%(D)s)
+#   static      ก่อนปรับ: route /static/ ของ Flask (ไม่มี cache header)
+#   direct      worker ส่ง bytes เอง (send_file -> sendfile)
+#   accel       ตอบแค่ header X-Accel-Redirect ให้ proxy ส่ง bytes แทน
+#   revalidate  client ส่ง If-None-Match (ได้ 304)
+# ใช้: python bench/image_serving_bench.py [--requests 400] [--concurrency 16] [--workers 2] [--size-kb 2048] [--slow-kbps 0]
+import argparse, hashlib, os, re, shutil, socket, statistics, subprocess, sys, tempfile, time, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from image_store import shard_key
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_images(root, count, size_kb):
+    keys = []
+    for i in range(count):
+        data = os.urandom(size_kb * 1024)
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = os.path.join(root, shard_key(sha256))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        keys.append(shard_key(sha256))
+    return keys
+
+
+def fetch(base, url, etag, slow_kbps):
+    req = urllib.request.Request(base + url, headers={"If-None-Match": f'"{etag}"'} if etag else {})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req) as resp:
+            while True:
+                chunk = resp.read(64 * 1024)
+                if not chunk:
+                    break
+                if slow_kbps:
+                    time.sleep(len(chunk) / 1024 / slow_kbps)
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+    return time.perf_counter() - start
+
+
+def run_mode(mode, args, workdir, keys, static_prefix):
+    if mode == "static":
+        urls = [f"{static_prefix}/{key}" for key in keys]
+    else:
+        urls = ["/images/" + key for key in keys]
+    port = free_port()
+    log = os.path.join(workdir, f"access-{mode}.log")
+    env = dict(os.environ, CHANNEL_SECRET="bench", CHANNEL_ACCESS_TOKEN="bench",
+               DATABASE_PATH=os.path.join(workdir, "bench.db"), THUMBNAILS="0")
+    if mode == "accel":
+        env["IMAGE_ACCEL_REDIRECT"] = "/protected/images/"
+    proc = subprocess.Popen(
+        ["gunicorn", "-w", str(args.workers), "-b", f"127.0.0.1:{port}", "--pythonpath", ROOT,
+         "--access-logfile", log, "--access-logformat", "%(D)s", "app:app"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(base + "/queue/stats").read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        open(log, "w").close()
+        jobs = [(urls[i % len(urls)], re.search(r"([0-9a-f]{64})", urls[i % len(urls)]).group(1) if mode == "revalidate" else None)
+                for i in range(args.requests)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            latencies = list(pool.map(lambda job: fetch(base, job[0], job[1], args.slow_kbps), jobs))
+        wall = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+    busy = sum(int(line) for line in open(log) if line.strip().isdigit()) / 1e6
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{mode:<11} {args.requests / wall:8.1f} req/s  p50 {statistics.median(latencies) * 1000:7.1f} ms"
+          f"  p99 {p99 * 1000:7.1f} ms  worker {busy / args.requests * 1000:6.2f} ms/req"
+          f"  occupancy {busy / (args.workers * wall) * 100:5.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--size-kb", type=int, default=2048)
+    parser.add_argument("--slow-kbps", type=float, default=0, help="simulate slow clients (KiB/s per download)")
+    parser.add_argument("--modes", default="static,direct,accel,revalidate")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    # route /static/ ของ Flask เสิร์ฟจาก <repo>/static เสมอ: โหมด static ต้องวางรูปไว้ที่นั่นชั่วคราว
+    static_root = os.path.join(ROOT, "static")
+    created_static = not os.path.isdir(static_root)
+    static_dir = None
+    try:
+        keys = make_images(os.path.join(workdir, "static/images"), args.images, args.size_kb)
+        if "static" in args.modes.split(","):
+            os.makedirs(static_root, exist_ok=True)
+            static_dir = tempfile.mkdtemp(dir=static_root, prefix="bench-")
+            shutil.copytree(os.path.join(workdir, "static/images"), static_dir, dirs_exist_ok=True)
+        static_prefix = "/static/" + os.path.basename(static_dir) if static_dir else None
+        for mode in args.modes.split(","):
+            run_mode(mode, args, workdir, keys, static_prefix)
+    finally:
+        shutil.rmtree(workdir)
+        if static_dir:
+            shutil.rmtree(static_root if created_static else static_dir)
+
+
+if __name__ == "__main__":
+    main()
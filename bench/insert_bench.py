@@ -0,0 +1,60 @@
+# เปรียบเทียบ inserts/sec: แบบเดิม (connect ทุกครั้ง) vs connection ต่อ thread + WAL vs group commit
+# ใช้: python bench/insert_bench.py [จำนวน insert] [จำนวน thread]
+import os, sys, sqlite3, tempfile, time, threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import storage
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+THREADS = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+ROW = ("U" + "0" * 32, "bench", None, "2024-01-01 00:00:00")
+
+
+def legacy_insert(path):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute(storage.INSERT_RECORD, ROW)
+    conn.commit()
+    conn.close()
+
+
+def pooled_insert(path):
+    conn = storage.get_conn()
+    with conn:
+        conn.execute(storage.INSERT_RECORD, ROW)
+
+
+def run(name, setup, insert):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "bench.db")
+        storage.DB_PATH = path
+        storage._local.__dict__.clear()
+        storage.init_db()
+        if setup is None:
+            # rollback journal แบบเดิม
+            sqlite3.connect(path).execute("PRAGMA journal_mode=DELETE").close()
+        ctx = setup(path) if setup else path
+        per_thread = N // THREADS
+
+        def worker():
+            for _ in range(per_thread):
+                insert(ctx)
+
+        threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        count = sqlite3.connect(path).execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        print(f"{name:<14} {count:>6} rows  {elapsed:7.3f}s  {count / elapsed:10.0f} inserts/sec")
+
+
+def batched(path):
+    return storage.CommitBatcher(path=path)
+
+
+run("legacy", None, legacy_insert)
+run("pooled+WAL", lambda path: path, pooled_insert)
+run("group-commit", batched, lambda b: b.submit(storage.INSERT_RECORD, ROW).result())
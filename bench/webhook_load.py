@@ -0,0 +1,167 @@
+# Load test /callback ด้วย webhook payload สังเคราะห์ (เซ็น signature จริง) กับ fake LINE API ในเครื่อง
+# รายงาน throughput, p50/p90/p99 latency และเวลาเฉลี่ยต่อ stage จาก /metrics
+# ใช้: python bench/webhook_load.py [--requests 500] [--concurrency 16] [--events-per-body 1]
+#          [--image-ratio 0.5] [--redeliver-ratio 0] [--workers 2] [--line-latency-ms 20] [--env KEY=VALUE ...]
+#      หรือยิงแอปที่รันอยู่แล้ว: --url http://127.0.0.1:8000 --secret <CHANNEL_SECRET>
+import argparse, base64, hashlib, hmac, http.client, json, os, random, re, shutil, socket, statistics
+import subprocess, sys, tempfile, time, urllib.parse, urllib.request, uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_line_api import start_fake_line_api
+
+
+def make_event(kind, user_id):
+    msg_id = str(random.randrange(10 ** 17, 10 ** 18))
+    if kind == "image":
+        message = {"type": "image", "id": msg_id, "quoteToken": "q", "contentProvider": {"type": "line"}}
+    else:
+        message = {"type": "text", "id": msg_id, "quoteToken": "q", "text": f"{random.randint(1, 999)}/{random.randint(1, 12)}"}
+    return {
+        "type": "message", "mode": "active", "timestamp": int(time.time() * 1000),
+        "webhookEventId": uuid.uuid4().hex.upper()[:26], "deliveryContext": {"isRedelivery": False},
+        "source": {"type": "user", "userId": user_id}, "replyToken": uuid.uuid4().hex, "message": message,
+    }
+
+
+def make_bodies(args):
+    bodies = []
+    for _ in range(args.requests):
+        if bodies and random.random() < args.redeliver_ratio:
+            # redelivery: body เดิมซ้ำ (ควรโดน dedupe)
+            bodies.append(random.choice(bodies))
+            continue
+        events = [make_event("image" if random.random() < args.image_ratio else "text",
+                             f"U{random.randrange(args.users):032x}")
+                  for _ in range(args.events_per_body)]
+        bodies.append(json.dumps({"destination": "Ubench", "events": events}).encode())
+    return bodies
+
+
+def sign(secret, body):
+    return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+
+def post(url, secret, body):
+    parts = urllib.parse.urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    start = time.perf_counter()
+    try:
+        conn.request("POST", "/callback", body, {"Content-Type": "application/json",
+                                                 "X-Line-Signature": sign(secret, body)})
+        status = conn.getresponse().status
+    except OSError:
+        status = "conn-error"
+    finally:
+        conn.close()
+    return status, time.perf_counter() - start
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app(args, fake, workdir):
+    port = free_port()
+    env = dict(os.environ, CHANNEL_SECRET=args.secret, CHANNEL_ACCESS_TOKEN="bench",
+               LINE_API_HOST=fake.url, LINE_BLOB_HOST=fake.url,
+               DATABASE_PATH=os.path.join(workdir, "bench.db"), LOG_LEVEL="WARNING")
+    env.update(kv.split("=", 1) for kv in args.env)
+    proc = subprocess.Popen(
+        ["gunicorn", "-w", str(args.workers), "-b", f"127.0.0.1:{port}", "--pythonpath", ROOT, "app:app"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url + "/metrics").read()
+            return proc, url
+        except OSError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("app did not start")
+
+
+def stage_means(url, samples=10):
+    # /metrics เป็นตัวเลขของ worker ที่ตอบ request นั้น: ดึงหลายครั้ง แล้วรวมผลของ worker ที่ไม่ซ้ำกัน
+    texts = {urllib.request.urlopen(url + "/metrics").read().decode() for _ in range(samples)}
+    sums, counts = Counter(), Counter()
+    for text in texts:
+        for kind, stage, value in re.findall(r'linebot_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)', text):
+            (sums if kind == "sum" else counts)[stage] += float(value)
+    return {stage: sums[stage] / counts[stage] for stage in counts if counts[stage]}
+
+
+def wait_drained(url, timeout=120):
+    # โหมด ASYNC_WEBHOOK: รอให้คิวของทุก worker ว่าง (สุ่มถามหลายครั้งติดกันแล้วว่างหมด)
+    deadline = time.time() + timeout
+    idle = 0
+    while time.time() < deadline and idle < 10:
+        stats = json.load(urllib.request.urlopen(url + "/queue/stats"))
+        done = stats["depth"] == 0 and stats["processed"] + stats["failed"] == stats["enqueued"]
+        idle = idle + 1 if done else 0
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="existing app (default: start gunicorn + fake LINE API)")
+    parser.add_argument("--secret", default="bench-secret")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--events-per-body", type=int, default=1)
+    parser.add_argument("--image-ratio", type=float, default=0.5)
+    parser.add_argument("--redeliver-ratio", type=float, default=0.0)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--line-latency-ms", type=float, default=20)
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--env", action="append", default=[], help="extra app env, e.g. --env ASYNC_WEBHOOK=1")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    bodies = make_bodies(args)
+    fake = workdir = proc = None
+    url = args.url
+    if url is None:
+        fake = start_fake_line_api(latency_ms=args.line_latency_ms, image_kb=args.image_kb)
+        workdir = tempfile.mkdtemp()
+        proc, url = start_app(args, fake, workdir)
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(pool.map(lambda body: post(url, args.secret, body), bodies))
+        wall = time.perf_counter() - start
+        wait_drained(url)
+        drained = time.perf_counter() - start
+        means = stage_means(url)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+        if workdir:
+            shutil.rmtree(workdir)
+
+    latencies = sorted(r[1] for r in results)
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(f"requests     {len(results)} in {wall:.2f}s  ->  {len(results) / wall:.1f} req/s, "
+          f"{len(results) * args.events_per_body / wall:.1f} events/s")
+    print(f"latency      p50 {statistics.median(latencies) * 1000:.1f} ms  p90 {pct(0.9):.1f} ms  "
+          f"p99 {pct(0.99):.1f} ms  max {latencies[-1] * 1000:.1f} ms")
+    print(f"status       {dict(Counter(r[0] for r in results))}")
+    if drained - wall > 0.6:
+        print(f"drained      all queued events processed after {drained:.2f}s "
+              f"({len(results) * args.events_per_body / drained:.1f} events/s)")
+    if fake:
+        print(f"fake LINE    {fake.downloads} downloads, {len(fake.replies)} replies")
+    if means:
+        print("stage means  " + "  ".join(f"{k} {v * 1000:.1f}ms" for k, v in sorted(means.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import os, queue, threading, time, logging, contextvars
+
+logger = logging.getLogger(__name__)
+
+# ตอนปิด worker (deploy/restart/SIGTERM) รอให้คิวว่างได้ไม่เกินเท่านี้ ควรน้อยกว่า graceful_timeout ของ gunicorn (30s)
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25"))
+
+
+# คิว event ภายใน process: /callback ตอบ 200 ทันที แล้วให้ worker thread ทยอยประมวลผล
+class EventQueue:
+    def __init__(self, dispatch, workers=4, maxsize=1000):
+        self.dispatch = dispatch
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "expired_replies": 0,
+            "max_depth": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+        }
+
+    def start(self):
+        # start แบบ lazy เพื่อให้ thread เกิดหลัง gunicorn fork worker แล้ว
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"event-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, events):
+        """Enqueue events; return the ones that did not fit (caller handles them inline)."""
+        self.start()
+        for i, event in enumerate(events):
+            try:
+                self._queue.put_nowait((time.monotonic(), contextvars.copy_context(), event))
+            except queue.Full:
+                self._incr("rejected", len(events) - i)
+                return events[i:]
+            depth = self._queue.qsize()
+            with self._lock:
+                self._stats["enqueued"] += 1
+                self._stats["max_depth"] = max(self._stats["max_depth"], depth)
+        return []
+
+    def reply_expired(self):
+        self._incr("expired_replies")
+
+    def join(self):
+        self._queue.join()
+
+    def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Wait up to ``timeout`` seconds for queued bodies to finish; return how many were lost.
+
+        Worker threads are daemons, so anything still queued when the
+        process exits is gone (LINE already got a 200 and will not redeliver).
+        """
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks and self._threads:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(remaining)
+            lost = self._queue.unfinished_tasks
+        if lost:
+            logger.error("🔥 Webhook queue not drained before exit, bodies lost",
+                         extra={"lost": lost, "timeout_s": timeout})
+        return lost
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["depth"] = self._queue.qsize()
+        stats["capacity"] = self._queue.maxsize
+        stats["workers"] = self.workers
+        done = stats["processed"] + stats["failed"]
+        stats["avg_wait_ms"] = round(stats["total_wait_ms"] / done, 2) if done else 0.0
+        return stats
+
+    def _incr(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _run(self):
+        while True:
+            queued_at, ctx, event = self._queue.get()
+            wait_ms = (time.monotonic() - queued_at) * 1000
+            with self._lock:
+                self._stats["total_wait_ms"] += wait_ms
+                self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+            try:
+                # รันใน context ของ request ต้นทาง (request id ใน log)
+                ctx.run(self.dispatch, event)
+                self._incr("processed")
+            except Exception:
+                self._incr("failed")
+                logger.exception("🔥 Worker error")
+            finally:
+                self._queue.task_done()
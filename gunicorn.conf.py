@@ -0,0 +1,10 @@
+# gunicorn โหลดไฟล์นี้อัตโนมัติจาก working directory (Procfile: gunicorn app:app)
+import sys
+
+
+def worker_exit(server, worker):
+    # ASYNC_WEBHOOK: body ที่ตอบ 200 ไปแล้วแต่ยังอยู่ในคิว ต้องประมวลผลให้เสร็จก่อน worker ปิด
+    # (ทำที่นี่แทน atexit เพราะตอน atexit thread pool ของ reply/thumbnail ปิดรับงานไปแล้ว)
+    app = sys.modules.get("app")
+    if app is not None:
+        app.event_queue.stop()
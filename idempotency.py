@@ -0,0 +1,98 @@
+import os, time, threading
+from collections import OrderedDict
+
+import storage
+
+# กัน LINE redelivery: event ที่บันทึกแล้วจะถูกข้ามก่อนโหลดรูป
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "100000"))
+IDEMPOTENCY_SWEEP_INTERVAL = float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", "600"))
+
+
+def event_key(event):
+    message_id = getattr(event.message, "id", "")
+    return f"{event.webhook_event_id or ''}:{message_id}"
+
+
+class IdempotencyIndex:
+    """In-process TTL cache in front of the ``processed_events`` table.
+
+    The cache answers repeats in O(1); the table makes the answer shared by
+    every gunicorn worker and survives restarts. Keys are written in the
+    same transaction as the records (see storage.save_batch), so a key is
+    only ever present once its rows are committed.
+    """
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_size=IDEMPOTENCY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self._stats = {"checked": 0, "cache_hits": 0, "db_hits": 0, "in_flight_hits": 0,
+                       "evicted": 0, "swept": 0}
+
+    def claim(self, key):
+        """Return True if the event must be processed, False if it is a duplicate.
+
+        A claimed key must be released with ``release()`` once the batch is done.
+        """
+        now = time.time()
+        with self._lock:
+            self._stats["checked"] += 1
+            expires = self._cache.get(key)
+            if expires is not None and expires > now:
+                self._stats["cache_hits"] += 1
+                return False
+            if key in self._in_flight:
+                # redelivery มาถึงระหว่างที่ตัวแรกยังประมวลผลอยู่
+                self._stats["in_flight_hits"] += 1
+                return False
+            self._in_flight.add(key)
+        processed_at = storage.find_processed_event(key, now - self.ttl)
+        if processed_at is not None:
+            with self._lock:
+                self._in_flight.discard(key)
+                self._stats["db_hits"] += 1
+                self._remember(key, processed_at + self.ttl)
+            return False
+        return True
+
+    def release(self, keys, committed=()):
+        """Release claimed keys; ``committed`` ones are remembered as processed."""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                self._in_flight.discard(key)
+            for key in committed:
+                self._remember(key, now + self.ttl)
+            sweep = now - self._last_sweep > IDEMPOTENCY_SWEEP_INTERVAL
+            if sweep:
+                self._last_sweep = now
+        if sweep:
+            swept = storage.delete_processed_events(now - self.ttl)
+            with self._lock:
+                self._stats["swept"] += swept
+
+    def _remember(self, key, expires):
+        self._cache[key] = expires
+        self._cache.move_to_end(key)
+        now = time.time()
+        # ลบตัวที่หมดอายุ/เกินขนาดจากหัว OrderedDict (เก่าสุดก่อน)
+        while self._cache:
+            oldest_key, oldest_expires = next(iter(self._cache.items()))
+            if len(self._cache) <= self.max_size and oldest_expires > now:
+                break
+            del self._cache[oldest_key]
+            self._stats["evicted"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached"] = len(self._cache)
+            stats["in_flight"] = len(self._in_flight)
+        hits = stats["cache_hits"] + stats["db_hits"] + stats["in_flight_hits"]
+        stats["hits"] = hits
+        stats["hit_rate"] = round(hits / stats["checked"], 4) if stats["checked"] else 0.0
+        return stats
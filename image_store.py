@@ -0,0 +1,159 @@
+import os, re, errno, shutil, hashlib, tempfile
+from abc import ABC, abstractmethod
+
+# เลือก backend ด้วย IMAGE_STORE=local|s3
+IMAGE_STORE = os.getenv("IMAGE_STORE", "local")
+IMAGE_DIR = os.getenv("IMAGE_DIR", "static/images")
+# ไฟล์ที่ยังโหลดไม่เสร็จ: ต้องอยู่นอก directory ที่เสิร์ฟออกไป (IMAGE_DIR, static/)
+IMAGE_TMP_DIR = os.getenv("IMAGE_TMP_DIR", ".tmp/images")
+IMAGE_EXT = ".jpg"
+IMAGE_URL_PREFIX = "/images/"
+
+_SHA256_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+
+class StagedImage:
+    """Upload streamed to a temp file; ``sha256`` is known before it is committed."""
+
+    def __init__(self, tmp_path, sha256, size):
+        self.tmp_path = tmp_path
+        self.sha256 = sha256
+        self.size = size
+
+
+def shard_key(sha256):
+    # แบ่ง directory 2 ชั้นตาม hash เพื่อไม่ให้ไฟล์กองอยู่ใน directory เดียว
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{IMAGE_EXT}"
+
+
+def content_hash(path):
+    """sha256 encoded in a content-addressed file name, or None for legacy names."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem if _SHA256_NAME.match(stem) else None
+
+
+class ImageStore(ABC):
+    """Backend interface: stage() -> commit() or discard()."""
+
+    def __init__(self, tmp_dir):
+        self.tmp_dir = tmp_dir
+        os.makedirs(tmp_dir, exist_ok=True)
+
+    def stage(self, chunks):
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return StagedImage(tmp_path, h.hexdigest(), size)
+
+    async def astage(self, chunks):
+        """Same as stage() for an async iterator of chunks (aiohttp download)."""
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async for chunk in chunks:
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return StagedImage(tmp_path, h.hexdigest(), size)
+
+    def discard(self, staged):
+        try:
+            os.unlink(staged.tmp_path)
+        except FileNotFoundError:
+            pass
+
+    @abstractmethod
+    def commit(self, staged):
+        """Move the staged file into place and return the path stored in ``records``."""
+
+    @abstractmethod
+    def url(self, path):
+        """URL the dashboard links to for a path returned by commit()."""
+
+
+class LocalImageStore(ImageStore):
+    def __init__(self, root=IMAGE_DIR, tmp_dir=IMAGE_TMP_DIR):
+        self.root = root
+        super().__init__(tmp_dir)
+
+    def commit(self, staged):
+        path = os.path.join(self.root, shard_key(staged.sha256))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # rename ใน filesystem เดียวกันเป็น atomic: ไม่มีใครเห็นไฟล์ที่เขียนไม่ครบ
+        try:
+            os.replace(staged.tmp_path, path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # IMAGE_DIR อยู่คนละ disk กับ IMAGE_TMP_DIR: copy เป็นไฟล์ซ่อน (.xxx) ข้างปลายทางก่อนแล้วค่อย rename
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".")
+            with os.fdopen(fd, "wb") as dst, open(staged.tmp_path, "rb") as src:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp_path, path)
+            self.discard(staged)
+        return path
+
+    def url(self, path):
+        prefix = self.root.rstrip("/") + "/"
+        if path.startswith(prefix):
+            return IMAGE_URL_PREFIX + path[len(prefix):]
+        return "/" + path.lstrip("/")
+
+
+class S3ImageStore(ImageStore):
+    """S3-compatible backend (AWS, MinIO, ...); needs ``boto3``."""
+
+    def __init__(self, bucket=None, prefix=None, endpoint_url=None, public_url=None, client=None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("IMAGE_STORE=s3 requires boto3 (pip install boto3)")
+            client = boto3.client("s3", endpoint_url=endpoint_url or os.getenv("S3_ENDPOINT_URL"))
+        self.bucket = bucket or os.environ["S3_BUCKET"]
+        self.prefix = (prefix if prefix is not None else os.getenv("S3_PREFIX", "images/")).lstrip("/")
+        # client: boto3 S3 client หรือตัวอื่นที่มี upload_file / generate_presigned_url (เช่น stand-in ตอนทดสอบ)
+        self.client = client
+        self.public_url = (public_url or os.getenv("S3_PUBLIC_URL", "")).rstrip("/")
+        super().__init__(os.path.join(tempfile.gettempdir(), "line-imagebot"))
+
+    def commit(self, staged):
+        key = self.prefix + shard_key(staged.sha256)
+        try:
+            self.client.upload_file(staged.tmp_path, self.bucket, key,
+                                    ExtraArgs={"ContentType": "image/jpeg"})
+        finally:
+            self.discard(staged)
+        return f"s3://{self.bucket}/{key}"
+
+    def url(self, path):
+        if not path.startswith("s3://"):
+            # แถวเก่าที่เก็บไว้บนดิสก์ก่อนย้ายมาใช้ S3
+            return "/" + path.lstrip("/")
+        key = path.split("/", 3)[3]
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=3600)
+
+
+def get_store():
+    if IMAGE_STORE == "s3":
+        return S3ImageStore()
+    if IMAGE_STORE == "local":
+        return LocalImageStore()
+    raise ValueError(f"unknown IMAGE_STORE: {IMAGE_STORE}")
@@ -0,0 +1,167 @@
+import os, time, random, asyncio, threading, atexit
+
+import aiohttp
+import urllib3
+import metrics
+from linebot.v3.messaging import (
+    MessagingApi,
+    Configuration,
+    ApiClient,
+    AsyncApiClient,
+    ReplyMessageRequest,
+    ApiException
+)
+
+# ตั้งค่า connection pool / timeout / retry ของ LINE API (ชี้ไป fake server ได้ด้วย LINE_API_HOST, LINE_BLOB_HOST)
+LINE_API_HOST = os.getenv("LINE_API_HOST", "https://api.line.me")
+LINE_BLOB_HOST = os.getenv("LINE_BLOB_HOST", "https://api-data.line.me")
+LINE_CONNECT_TIMEOUT = float(os.getenv("LINE_CONNECT_TIMEOUT", "3"))
+LINE_READ_TIMEOUT = float(os.getenv("LINE_READ_TIMEOUT", "10"))
+LINE_DOWNLOAD_RETRIES = int(os.getenv("LINE_DOWNLOAD_RETRIES", "3"))
+LINE_RETRY_BACKOFF = float(os.getenv("LINE_RETRY_BACKOFF", "0.2"))
+LINE_RETRY_BACKOFF_MAX = float(os.getenv("LINE_RETRY_BACKOFF_MAX", "5"))
+CHUNK_SIZE = 64 * 1024
+
+configuration = Configuration(access_token=os.getenv("CHANNEL_ACCESS_TOKEN"), host=LINE_API_HOST)
+# SDK ตั้ง connection_pool_maxsize = cpu_count() * 5 อยู่แล้ว; LINE_POOL_MAXSIZE ใช้ override
+# (เช่นบนเครื่องที่ cpu_count() เห็น CPU ของ host ทั้งเครื่อง) ค่านี้ใช้เป็นขนาด reply pool และจำนวน download พร้อมกันด้วย
+if os.getenv("LINE_POOL_MAXSIZE"):
+    configuration.connection_pool_maxsize = int(os.environ["LINE_POOL_MAXSIZE"])
+LINE_POOL_MAXSIZE = configuration.connection_pool_maxsize
+api_client = ApiClient(configuration)
+line_bot_api = MessagingApi(api_client)
+
+
+def request_timeout():
+    return (LINE_CONNECT_TIMEOUT, LINE_READ_TIMEOUT)
+
+
+def reply_message(reply_token, messages):
+    with metrics.timer("reply"):
+        return line_bot_api.reply_message(
+            ReplyMessageRequest(reply_token=reply_token, messages=messages),
+            _request_timeout=request_timeout())
+
+
+def content_url(msg_id):
+    return f"{LINE_BLOB_HOST}/v2/bot/message/{msg_id}/content"
+
+
+def auth_headers():
+    return {"Authorization": f"Bearer {configuration.access_token}"}
+
+
+def iter_message_content(msg_id):
+    # SDK โหลดทั้งก้อนเข้าหน่วยความจำ จึงยิงผ่าน connection pool ของ api_client เองแล้วอ่านทีละ chunk
+    resp = api_client.rest_client.pool_manager.request(
+        "GET", content_url(msg_id), headers=auth_headers(), preload_content=False, retries=False,
+        timeout=urllib3.Timeout(connect=LINE_CONNECT_TIMEOUT, read=LINE_READ_TIMEOUT))
+    try:
+        if resp.status >= 400:
+            raise ApiException(status=resp.status, reason=resp.reason)
+        yield from resp.stream(CHUNK_SIZE)
+    finally:
+        # อ่าน body ที่เหลือ (เช่น error JSON) ก่อนคืน connection ไม่งั้น request ถัดไปบน keep-alive จะอ่านเศษ body นี้เป็น status line
+        resp.drain_conn()
+        resp.release_conn()
+
+
+def is_retryable(error):
+    if isinstance(error, ApiException):
+        return error.status == 429 or (error.status or 0) >= 500
+    return isinstance(error, (urllib3.exceptions.HTTPError, aiohttp.ClientError, OSError, asyncio.TimeoutError))
+
+
+def backoff(attempt):
+    # full jitter: กัน worker หลายตัว retry พร้อมกันเป็นจังหวะเดียว
+    return random.uniform(0, min(LINE_RETRY_BACKOFF_MAX, LINE_RETRY_BACKOFF * 2 ** attempt))
+
+
+def download_content(msg_id, stage):
+    """Stream message content into ``stage`` (e.g. ImageStore.stage), retrying transient errors.
+
+    Blob downloads are idempotent, so the whole download restarts on failure.
+    """
+    for attempt in range(LINE_DOWNLOAD_RETRIES + 1):
+        try:
+            with metrics.timer("download"):
+                return stage(iter_message_content(msg_id))
+        except Exception as e:
+            if attempt == LINE_DOWNLOAD_RETRIES or not is_retryable(e):
+                raise
+            metrics.errors_total.inc("download_retry")
+            time.sleep(backoff(attempt))
+
+
+class AsyncDownloader:
+    """Downloads several message contents concurrently on a background event loop.
+
+    The loop and its AsyncApiClient (aiohttp session) live for the whole
+    process, so connections are reused across webhook requests.
+    """
+
+    def __init__(self, max_concurrency=LINE_POOL_MAXSIZE):
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="line-async", daemon=True).start()
+            self._client = asyncio.run_coroutine_threadsafe(self._make_client(), loop).result()
+            self._loop, self._pid = loop, os.getpid()
+            atexit.register(self.close)
+            return loop
+
+    def close(self):
+        if self._loop is not None and self._pid == os.getpid():
+            asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = None
+
+    async def _make_client(self):
+        return AsyncApiClient(configuration)
+
+    async def _fetch_once(self, msg_id, astage, timeout):
+        # จับเวลาเฉพาะ request + เขียนไฟล์ เหมือน metrics.timer("download") ของ path sync (ไม่รวม backoff)
+        start = time.perf_counter()
+        try:
+            async with self._client.rest_client.pool_manager.get(
+                    content_url(msg_id), headers=auth_headers(), timeout=timeout) as resp:
+                if resp.status >= 400:
+                    raise ApiException(status=resp.status, reason=resp.reason)
+                return await astage(resp.content.iter_chunked(CHUNK_SIZE))
+        finally:
+            metrics.stage_seconds.observe(time.perf_counter() - start, "download")
+
+    async def _fetch(self, msg_id, astage, semaphore):
+        timeout = aiohttp.ClientTimeout(sock_connect=LINE_CONNECT_TIMEOUT, sock_read=LINE_READ_TIMEOUT)
+        async with semaphore:
+            for attempt in range(LINE_DOWNLOAD_RETRIES + 1):
+                try:
+                    return await self._fetch_once(msg_id, astage, timeout)
+                except Exception as e:
+                    if attempt == LINE_DOWNLOAD_RETRIES or not is_retryable(e):
+                        raise
+                    metrics.errors_total.inc("download_retry")
+                    await asyncio.sleep(backoff(attempt))
+
+    async def _fetch_all(self, msg_ids, astage):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(*(self._fetch(m, astage, semaphore) for m in msg_ids),
+                                    return_exceptions=True)
+
+    def download_many(self, msg_ids, astage):
+        """Return one result per msg_id, in order; failures are returned as exceptions."""
+        if not msg_ids:
+            return []
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._fetch_all(msg_ids, astage), loop).result()
+
+
+async_downloader = AsyncDownloader()
@@ -0,0 +1,122 @@
+import time, threading
+from contextlib import contextmanager
+
+# metric ภายใน process (แต่ละ gunicorn worker มีชุดของตัวเอง) ส่งออกเป็น Prometheus text format ที่ /metrics
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, values)} {v}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), values + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), values + ('+Inf',))} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, values)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labels, values)} {count}")
+        return lines
+
+
+class Stats:
+    """Exports a stats() dict (e.g. EventQueue.stats) at scrape time.
+
+    ``counters`` and ``gauges`` map a stats key to (metric name suffix, help);
+    keys listed in neither are not exported. Values that only ever grow must
+    be counters so rate()/increase() handle worker restarts.
+    """
+
+    def __init__(self, prefix, collect, counters=None, gauges=None):
+        self.prefix, self.collect = prefix, collect
+        self.counters, self.gauges = counters or {}, gauges or {}
+
+    def render(self):
+        stats = self.collect()
+        lines = []
+        for kind, metrics in (("counter", self.counters), ("gauge", self.gauges)):
+            for key, (suffix, help) in metrics.items():
+                name = f"{self.prefix}_{suffix}"
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {stats[key]}"]
+        return lines
+
+
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+stage_seconds = register(Histogram(
+    "linebot_stage_seconds", "Latency of each webhook processing stage.", labels=("stage",)))
+events_total = register(Counter(
+    "linebot_events_total", "Webhook message events by type and outcome.", labels=("type", "outcome")))
+webhook_requests_total = register(Counter(
+    "linebot_webhook_requests_total", "Webhook requests by HTTP status.", labels=("status",)))
+errors_total = register(Counter(
+    "linebot_errors_total", "Errors by stage.", labels=("stage",)))
+
+
+@contextmanager
+def timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage)
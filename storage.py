@@ -0,0 +1,293 @@
+import os, sqlite3, threading, time, queue, base64, logging
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("DATABASE_PATH", "database.db")
+# group commit: รวม insert จากหลาย event ให้อยู่ใน transaction เดียว (ปิดได้ด้วย DB_BATCH_SIZE=1)
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", "64"))
+DB_BATCH_WINDOW_MS = float(os.getenv("DB_BATCH_WINDOW_MS", "0"))
+# ผู้เรียกรอ db-writer ได้ไม่เกินเท่านี้ (กันค้างตลอดไปถ้า writer มีปัญหา)
+DB_WRITE_TIMEOUT = float(os.getenv("DB_WRITE_TIMEOUT", "30"))
+
+PRAGMAS = (
+    # busy_timeout ต้องมาก่อน: ตั้ง WAL ตอนที่ worker อื่นถือ lock อยู่จะได้รอแทนที่จะ error "database is locked" ทันที
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+INSERT_RECORD = "INSERT INTO records (user_id, text, image_path, timestamp) VALUES (?, ?, ?, ?)"
+INSERT_IMAGE = "INSERT OR IGNORE INTO images (sha256, path, size, created_at) VALUES (?, ?, ?, ?)"
+INSERT_PROCESSED = "INSERT OR IGNORE INTO processed_events (event_key, processed_at) VALUES (?, ?)"
+
+_local = threading.local()
+
+
+def connect(path=None):
+    # cached_statements: sqlite3 เก็บ prepared statement ไว้ใช้ซ้ำต่อ connection
+    conn = sqlite3.connect(path or DB_PATH, check_same_thread=False, cached_statements=256)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_conn():
+    # หนึ่ง connection ต่อ thread ต่อ process (สร้างใหม่หลัง gunicorn fork)
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = connect()
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def init_db():
+    conn = connect()
+    conn.execute('''CREATE TABLE IF NOT EXISTS records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT,
+        text TEXT,
+        image_path TEXT,
+        timestamp TEXT
+    )''')
+    # thumbnail/WebP ของรูป (เพิ่มทีหลัง จึงต้อง ALTER ฐานข้อมูลเดิม)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(records)")}
+    for column in ("thumb_path", "webp_path"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE records ADD COLUMN {column} TEXT")
+    # index สำหรับ keyset pagination: เรียงตาม (timestamp, id) ทั้งแบบกรอง user และไม่กรอง
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_records_user_ts ON records (user_id, timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_records_ts ON records (timestamp)")
+    # hash index ของรูป: รูปเดียวกันที่ส่งซ้ำจะชี้ไปที่ไฟล์เดิม
+    conn.execute('''CREATE TABLE IF NOT EXISTS images (
+        sha256 TEXT PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        size INTEGER,
+        created_at TEXT
+    )''')
+    # idempotency index: event ที่บันทึกแล้ว (webhookEventId:messageId) ลบทิ้งเมื่อเกิน TTL
+    conn.execute('''CREATE TABLE IF NOT EXISTS processed_events (
+        event_key TEXT PRIMARY KEY,
+        processed_at REAL NOT NULL
+    ) WITHOUT ROWID''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_processed_events_at ON processed_events (processed_at)")
+    conn.commit()
+    conn.close()
+
+
+class CommitBatcher:
+    """Single writer thread that commits queued writes in one transaction per batch.
+
+    A write is either one statement (``submit``) or a unit of work
+    (``submit_unit``): a function called with the writer's connection whose
+    statements must commit together, e.g. all rows of one webhook body.
+    """
+
+    def __init__(self, path=None, batch_size=DB_BATCH_SIZE, window_ms=DB_BATCH_WINDOW_MS):
+        self.path = path
+        self.batch_size = batch_size
+        self.window = window_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, sql, params):
+        return self.submit_unit(lambda conn: conn.execute(sql, params).lastrowid)
+
+    def submit_unit(self, fn):
+        fut = Future()
+        # put ภายใต้ lock: ไม่มีงานตกค้างในคิวของ writer ที่กำลังตาย
+        with self._lock:
+            self._ensure_started()
+            self._queue.put((fn, fut))
+        return fut
+
+    def _ensure_started(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), name="db-writer", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self, q):
+        batch = []
+        try:
+            conn = connect(self.path)
+            while True:
+                batch = [q.get()]
+                # เก็บทุกอย่างที่รออยู่ระหว่าง commit ก่อนหน้า แล้วรอเพิ่มได้อีกไม่เกิน window
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        if timeout > 0:
+                            batch.append(q.get(timeout=timeout))
+                        else:
+                            batch.append(q.get_nowait())
+                    except queue.Empty:
+                        break
+                self._flush(conn, batch)
+        except Exception as e:
+            # writer ตาย (เช่น connect ไม่ได้): แจ้ง error ให้ทุกงานที่รออยู่ แล้วให้ submit ครั้งถัดไปสร้าง thread ใหม่
+            logger.exception("🔥 db-writer stopped")
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+                pending = batch
+                while True:
+                    try:
+                        pending.append(q.get_nowait())
+                    except queue.Empty:
+                        break
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+
+    def _flush(self, conn, batch):
+        try:
+            with conn:
+                results = [fn(conn) for fn, _ in batch]
+        except Exception:
+            # batch ล้มทั้งก้อน: ลองทีละรายการเพื่อไม่ให้ event อื่นเสียไปด้วย
+            for fn, fut in batch:
+                try:
+                    with conn:
+                        result = fn(conn)
+                except Exception as e:
+                    fut.set_exception(e)
+                else:
+                    # แจ้งผลหลัง commit แล้วเท่านั้น
+                    fut.set_result(result)
+            return
+        for (_, fut), result in zip(batch, results):
+            fut.set_result(result)
+
+
+batcher = CommitBatcher() if DB_BATCH_SIZE > 1 else None
+
+
+def write_unit(fn):
+    """Run ``fn(conn)`` in a write transaction (group-committed when the batcher is on)."""
+    if batcher is not None:
+        # timeout แล้วงานอาจยัง commit ทีหลังได้ ผู้เรียกจึงต้องถือว่าผลไม่แน่นอน (เช่นไม่จำ idempotency key)
+        return batcher.submit_unit(fn).result(timeout=DB_WRITE_TIMEOUT)
+    conn = get_conn()
+    with conn:
+        return fn(conn)
+
+
+def execute_write(sql, params):
+    return write_unit(lambda conn: conn.execute(sql, params).lastrowid)
+
+
+def save_batch(records, images=(), event_keys=None):
+    """Insert the rows of one webhook body (records + new images) in a single transaction.
+
+    With ``event_keys`` (one per record) each key is recorded in
+    ``processed_events`` in the same transaction, and a record whose key is
+    already there is skipped. Returns the number of records inserted.
+    """
+    if not records and not images:
+        return 0
+
+    def insert(conn):
+        conn.executemany(INSERT_IMAGE, images)
+        if event_keys is None:
+            conn.executemany(INSERT_RECORD, records)
+            return len(records)
+        inserted = 0
+        now = time.time()
+        for key, record in zip(event_keys, records):
+            if conn.execute(INSERT_PROCESSED, (key, now)).rowcount:
+                conn.execute(INSERT_RECORD, record)
+                inserted += 1
+        return inserted
+
+    return write_unit(insert)
+
+
+def find_processed_event(event_key, not_before):
+    row = get_conn().execute(
+        "SELECT processed_at FROM processed_events WHERE event_key = ? AND processed_at >= ?",
+        (event_key, not_before)).fetchone()
+    return row[0] if row else None
+
+
+def delete_processed_events(before):
+    return write_unit(lambda conn: conn.execute(
+        "DELETE FROM processed_events WHERE processed_at < ?", (before,)).rowcount)
+
+
+def find_image(sha256):
+    row = get_conn().execute("SELECT path FROM images WHERE sha256 = ?", (sha256,)).fetchone()
+    return row[0] if row else None
+
+
+RECORD_COLUMNS = "id, user_id, text, image_path, timestamp, thumb_path, webp_path"
+
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(f"{row[4]}|{row[0]}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, rowid = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return timestamp, int(rowid)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+
+def query_records(user_id=None, date_from=None, date_to=None, cursor=None, limit=50):
+    """Return one page of records (newest first) and the cursor of the next page.
+
+    date_from/date_to are inclusive ``YYYY-MM-DD`` strings; timestamps are stored
+    as ``YYYY-MM-DD HH:MM:SS`` so plain string comparison keeps them in order.
+    """
+    where, params = [], []
+    if user_id:
+        where.append("user_id = ?")
+        params.append(user_id)
+    if date_from:
+        where.append("timestamp >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("timestamp < ?")
+        params.append(date_to + "\uffff")
+    if cursor:
+        timestamp, rowid = decode_cursor(cursor)
+        # row-value comparison ให้ SQLite seek ใน index ได้ตรงๆ ไม่ต้อง scan ข้ามหน้าก่อนๆ
+        where.append("(timestamp, id) < (?, ?)")
+        params.extend([timestamp, rowid])
+    sql = f"SELECT {RECORD_COLUMNS} FROM records"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    # ดึงเกินมา 1 แถวเพื่อรู้ว่ามีหน้าถัดไปหรือไม่
+    rows = get_conn().execute(sql, params + [limit + 1]).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# thumb_path ของรูปที่สร้าง thumbnail ไม่ได้ (ไฟล์หาย/เสีย): ไม่ต้องลองใหม่ทุกครั้งที่เปิด dashboard
+THUMB_FAILED = ""
+
+
+def set_derivatives(image_path, thumb_path, webp_path):
+    # อัปเดตทุกแถวที่ใช้รูปเดียวกัน (รูปซ้ำชี้ไปไฟล์เดิม)
+    execute_write("UPDATE records SET thumb_path = ?, webp_path = ? WHERE image_path = ?",
+                  (thumb_path, webp_path, image_path))
+
+
+def mark_thumb_failed(image_path):
+    execute_write("UPDATE records SET thumb_path = ? WHERE image_path = ? AND thumb_path IS NULL",
+                  (THUMB_FAILED, image_path))
+
+
+def images_missing_thumbs(limit=100):
+    return [row[0] for row in get_conn().execute(
+        "SELECT DISTINCT image_path FROM records WHERE image_path IS NOT NULL AND thumb_path IS NULL LIMIT ?",
+        (limit,))]
@@ -0,0 +1,54 @@
+import base64, hashlib, hmac, json, os, sys, tempfile, time, uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench.fake_line_api import start_fake_line_api
+
+# แอปอ่าน config ตอน import: ตั้ง env ให้ชี้ไป fake LINE API และ directory ชั่วคราวก่อน import app
+CHANNEL_SECRET = "test-secret"
+WORKDIR = tempfile.mkdtemp(prefix="linebot-test-")
+FAKE_LINE = start_fake_line_api(image_kb=4)
+os.environ.update(
+    CHANNEL_SECRET=CHANNEL_SECRET,
+    CHANNEL_ACCESS_TOKEN="test-token",
+    LINE_API_HOST=FAKE_LINE.url,
+    LINE_BLOB_HOST=FAKE_LINE.url,
+    DATABASE_PATH=os.path.join(WORKDIR, "test.db"),
+    IMAGE_DIR=os.path.join(WORKDIR, "images"),
+    IMAGE_TMP_DIR=os.path.join(WORKDIR, "tmp"),
+    THUMB_DIR=os.path.join(WORKDIR, "thumbs"),
+    THUMBNAILS="0",
+    ASYNC_WEBHOOK="1",
+    LOG_LEVEL="WARNING",
+)
+
+
+@pytest.fixture
+def fake_line():
+    """The shared fake LINE API, reset to fast and healthy after each test."""
+    yield FAKE_LINE
+    FAKE_LINE.latency, FAKE_LINE.fail_rate, FAKE_LINE.fail_status = 0, 0.0, 500
+    FAKE_LINE.fail_ids.clear()
+
+
+def make_event(kind="text", age=0.0):
+    msg_id = str(uuid.uuid4().int % 10 ** 18)
+    if kind == "image":
+        message = {"type": "image", "id": msg_id, "quoteToken": "q", "contentProvider": {"type": "line"}}
+    else:
+        message = {"type": "text", "id": msg_id, "quoteToken": "q", "text": "12/2024"}
+    return {
+        "type": "message", "mode": "active", "timestamp": int((time.time() - age) * 1000),
+        "webhookEventId": uuid.uuid4().hex.upper()[:26], "deliveryContext": {"isRedelivery": False},
+        "source": {"type": "user", "userId": "U" + uuid.uuid4().hex}, "replyToken": uuid.uuid4().hex,
+        "message": message,
+    }
+
+
+def post_events(client, *events):
+    body = json.dumps({"destination": "Utest", "events": list(events)}).encode()
+    signature = base64.b64encode(hmac.new(CHANNEL_SECRET.encode(), body, hashlib.sha256).digest()).decode()
+    return client.post("/callback", data=body, headers={"Content-Type": "application/json",
+                                                         "X-Line-Signature": signature})
@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+import app as webapp
+import storage
+from event_queue import EventQueue
+from conftest import make_event, post_events
+
+
+@pytest.fixture
+def client():
+    webapp.event_queue.join()
+    return webapp.app.test_client()
+
+
+def records_of(event):
+    rows, _ = storage.query_records(user_id=event["source"]["userId"])
+    return rows
+
+
+def test_callback_returns_before_processing(client, fake_line):
+    fake_line.latency = 0.3
+    event = make_event("image")
+    start = time.perf_counter()
+    resp = post_events(client, event)
+    assert resp.status_code == 200
+    assert time.perf_counter() - start < 0.3
+    assert records_of(event) == []
+
+    webapp.event_queue.join()
+    rows = records_of(event)
+    assert len(rows) == 1 and rows[0][3]
+    assert any(r["replyToken"] == event["replyToken"] for r in fake_line.replies)
+
+
+def test_full_queue_is_processed_inline(client, monkeypatch):
+    # ไม่มี worker: body แรกค้างในคิว body ที่สองล้นคิวจึงต้องประมวลผลใน request เลย
+    queue = EventQueue(webapp.process_batch, workers=0, maxsize=1)
+    monkeypatch.setattr(webapp, "event_queue", queue)
+    queued, inline = make_event(), make_event()
+    assert post_events(client, queued).status_code == 200
+    assert post_events(client, inline).status_code == 200
+
+    stats = queue.stats()
+    assert stats["enqueued"] == 1 and stats["rejected"] == 1
+    assert records_of(queued) == []
+    assert len(records_of(inline)) == 1
+
+
+def test_expired_reply_token_skips_reply(client, fake_line):
+    expired_before = webapp.event_queue.stats()["expired_replies"]
+    event = make_event(age=webapp.REPLY_TOKEN_TTL + 10)
+    assert post_events(client, event).status_code == 200
+    webapp.event_queue.join()
+
+    assert len(records_of(event)) == 1
+    assert webapp.event_queue.stats()["expired_replies"] == expired_before + 1
+    assert all(r["replyToken"] != event["replyToken"] for r in fake_line.replies)
+
+
+def test_invalid_signature(client):
+    resp = client.post("/callback", data=b"{}", headers={"X-Line-Signature": "bad"})
+    assert resp.status_code == 400
+
+
+def test_stop_drains_queue_before_exit():
+    done = []
+    queue = EventQueue(lambda body: (time.sleep(0.1), done.append(body)), workers=1, maxsize=10)
+    queue.submit([1, 2, 3])
+    assert queue.stop(timeout=5) == 0
+    assert done == [1, 2, 3]
+
+
+def test_stop_reports_lost_bodies_after_deadline(caplog):
+    queue = EventQueue(lambda body: time.sleep(1), workers=1, maxsize=10)
+    queue.submit([1, 2, 3])
+    start = time.perf_counter()
+    assert queue.stop(timeout=0.2) >= 2
+    assert time.perf_counter() - start < 0.9
+    assert any("bodies lost" in r.getMessage() for r in caplog.records)
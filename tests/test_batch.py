@@ -0,0 +1,28 @@
+import copy, os, uuid
+
+import app as webapp
+import storage
+from conftest import make_event, post_events
+
+
+def test_body_is_one_group_committed_unit_with_one_download_per_image(fake_line, monkeypatch):
+    units = []
+    submit_unit = storage.batcher.submit_unit
+    monkeypatch.setattr(storage.batcher, "submit_unit", lambda fn: (units.append(fn), submit_unit(fn))[1])
+    first, other = make_event("image"), make_event("image")
+    # message เดียวกันอยู่สองครั้งใน body (event id ต่างกัน)
+    again = copy.deepcopy(first)
+    again["webhookEventId"] = uuid.uuid4().hex.upper()[:26]
+    for event in (other, again):
+        event["source"] = first["source"]
+    downloads = fake_line.downloads
+
+    assert post_events(webapp.app.test_client(), first, other, again).status_code == 200
+    webapp.event_queue.join()
+
+    rows, _ = storage.query_records(user_id=first["source"]["userId"])
+    assert len(rows) == 3
+    assert fake_line.downloads - downloads == 2
+    assert len({r[3] for r in rows}) == 2
+    assert len(units) == 1
+    assert os.listdir(webapp.image_store.tmp_dir) == []
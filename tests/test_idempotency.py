@@ -0,0 +1,97 @@
+import time, uuid
+
+import pytest
+
+import app as webapp
+import idempotency
+import line_client
+import storage
+from idempotency import IdempotencyIndex
+from conftest import make_event, post_events
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(line_client, "LINE_DOWNLOAD_RETRIES", 1)
+    monkeypatch.setattr(line_client, "LINE_RETRY_BACKOFF", 0)
+    return webapp.app.test_client()
+
+
+def deliver(client, event):
+    assert post_events(client, event).status_code == 200
+    webapp.event_queue.join()
+    rows, _ = storage.query_records(user_id=event["source"]["userId"])
+    return rows
+
+
+def key_of(event):
+    return f"{event['webhookEventId']}:{event['message']['id']}"
+
+
+def test_redelivery_is_skipped_from_cache_then_db(client, fake_line):
+    event = make_event("image")
+    downloads = fake_line.downloads
+    assert len(deliver(client, event)) == 1
+    stats = webapp.idempotency.stats()
+
+    assert len(deliver(client, event)) == 1
+    assert webapp.idempotency.stats()["cache_hits"] == stats["cache_hits"] + 1
+
+    # process ใหม่ / worker อื่น: ไม่มีใน cache แต่มีใน processed_events
+    with webapp.idempotency._lock:
+        webapp.idempotency._cache.clear()
+    assert len(deliver(client, event)) == 1
+    assert webapp.idempotency.stats()["db_hits"] == stats["db_hits"] + 1
+    assert fake_line.downloads - downloads == 1
+
+
+def test_failed_event_is_processed_on_redelivery(client, fake_line):
+    event = make_event("image")
+    fake_line.fail_ids.add(event["message"]["id"])
+    assert deliver(client, event) == []
+    assert key_of(event) not in webapp.idempotency._cache
+    assert storage.find_processed_event(key_of(event), 0) is None
+
+    fake_line.fail_ids.clear()
+    rows = deliver(client, event)
+    assert len(rows) == 1 and rows[0][3]
+    assert key_of(event) in webapp.idempotency._cache
+
+
+def test_in_flight_duplicate_is_skipped():
+    index = IdempotencyIndex()
+    key = uuid.uuid4().hex
+    assert index.claim(key)
+    assert not index.claim(key)
+    assert index.stats()["in_flight_hits"] == 1
+    # ตัวแรกล้มเหลว: ปล่อย key โดยไม่จำ จึง claim ได้อีก
+    index.release([key])
+    assert index.claim(key)
+
+
+def test_cache_evicts_oldest_and_expired_keys():
+    index = IdempotencyIndex(ttl=0.2, max_size=2)
+    keys = [uuid.uuid4().hex for _ in range(4)]
+    index.release([], committed=keys[:3])
+    assert list(index._cache) == keys[1:3]
+    assert index.stats()["evicted"] == 1
+    assert not index.claim(keys[2])
+
+    time.sleep(0.25)
+    index.release([], committed=keys[3:])
+    assert list(index._cache) == keys[3:]
+    assert index.stats()["evicted"] == 3
+    assert index.claim(keys[2])
+
+
+def test_sweep_deletes_expired_processed_events(monkeypatch):
+    old, fresh = uuid.uuid4().hex, uuid.uuid4().hex
+    now = time.time()
+    storage.write_unit(lambda conn: conn.executemany(storage.INSERT_PROCESSED, [(old, now - 3600), (fresh, now)]))
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_SWEEP_INTERVAL", 0)
+    index = IdempotencyIndex(ttl=60)
+
+    index.release([])
+    assert index.stats()["swept"] >= 1
+    assert storage.find_processed_event(old, 0) is None
+    assert storage.find_processed_event(fresh, 0) == now
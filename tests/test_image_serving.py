@@ -0,0 +1,27 @@
+import os
+
+import app as webapp
+from image_store import shard_key
+
+
+def test_images_route_serves_committed_files_only():
+    store = webapp.image_store
+    staged = store.stage([os.urandom(2048)])
+    key = shard_key(staged.sha256)
+    store.commit(staged)
+    client = webapp.app.test_client()
+
+    resp = client.get("/images/" + key)
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] == f'"{staged.sha256}"'
+    assert "immutable" in resp.headers["Cache-Control"]
+    assert client.get("/images/" + key, headers={"If-None-Match": f'"{staged.sha256}"'}).status_code == 304
+    assert client.get("/images/" + key, headers={"Range": "bytes=0-9"}).status_code == 206
+
+    # ไฟล์ชั่วคราวใน directory ซ่อนต้องไม่ถูกเสิร์ฟ
+    hidden = os.path.join(store.root, ".tmp", "upload.part")
+    os.makedirs(os.path.dirname(hidden), exist_ok=True)
+    with open(hidden, "wb") as f:
+        f.write(b"partial")
+    assert client.get("/images/.tmp/upload.part").status_code == 404
+    assert client.get("/images/../images/.tmp/upload.part").status_code == 404
@@ -0,0 +1,57 @@
+import hashlib, os
+
+import pytest
+
+from image_store import ImageStore, LocalImageStore, S3ImageStore, shard_key
+
+
+class FakeS3Client:
+    """Local stand-in for the boto3 S3 client calls S3ImageStore makes."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        with open(filename, "rb") as f:
+            self.objects[(bucket, key)] = (f.read(), (ExtraArgs or {}).get("ContentType"))
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+def test_image_store_is_abstract():
+    with pytest.raises(TypeError):
+        ImageStore("tmp")
+
+
+def test_local_store_stages_outside_served_root(tmp_path):
+    store = LocalImageStore(root=str(tmp_path / "images"), tmp_dir=str(tmp_path / "tmp"))
+    data = b"\xff\xd8 photo \xff\xd9"
+    staged = store.stage([data[:4], data[4:]])
+    assert not staged.tmp_path.startswith(store.root)
+    assert staged.sha256 == hashlib.sha256(data).hexdigest() and staged.size == len(data)
+
+    path = store.commit(staged)
+    assert path == os.path.join(store.root, shard_key(staged.sha256))
+    assert open(path, "rb").read() == data
+    assert not os.path.exists(staged.tmp_path)
+    assert store.url(path) == "/images/" + shard_key(staged.sha256)
+
+
+def test_s3_store_with_local_stand_in(tmp_path, monkeypatch):
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    client = FakeS3Client()
+    store = S3ImageStore(bucket="photos", prefix="images/", client=client)
+    data = b"\xff\xd8 s3 photo \xff\xd9"
+    staged = store.stage([data])
+
+    path = store.commit(staged)
+    key = "images/" + shard_key(staged.sha256)
+    assert path == f"s3://photos/{key}"
+    assert client.objects[("photos", key)] == (data, "image/jpeg")
+    assert not os.path.exists(staged.tmp_path)
+    assert store.url(path).startswith(f"https://s3.test/photos/{key}")
+    assert store.url("static/images/legacy.jpg") == "/static/images/legacy.jpg"
+
+    store.public_url = "https://cdn.test"
+    assert store.url(path) == f"https://cdn.test/{key}"
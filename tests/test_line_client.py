@@ -0,0 +1,95 @@
+import os, time
+
+import pytest
+import urllib3
+from linebot.v3.messaging import ApiException
+
+import line_client
+import metrics
+from image_store import LocalImageStore, StagedImage
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalImageStore(root=str(tmp_path / "images"), tmp_dir=str(tmp_path / "tmp"))
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(line_client, "LINE_DOWNLOAD_RETRIES", 2)
+    monkeypatch.setattr(line_client, "LINE_RETRY_BACKOFF", 0)
+
+
+def test_download_retries_5xx_then_gives_up(fake_line, store):
+    fake_line.fail_rate = 1.0
+    failures = fake_line.failures
+    with pytest.raises(ApiException) as e:
+        line_client.download_content("m-5xx", store.stage)
+    assert e.value.status == 500
+    assert fake_line.failures - failures == line_client.LINE_DOWNLOAD_RETRIES + 1
+    assert os.listdir(store.tmp_dir) == []
+
+
+def test_download_does_not_retry_4xx(fake_line, store):
+    fake_line.fail_rate, fake_line.fail_status = 1.0, 404
+    failures = fake_line.failures
+    with pytest.raises(ApiException) as e:
+        line_client.download_content("m-4xx", store.stage)
+    assert e.value.status == 404
+    assert fake_line.failures - failures == 1
+
+
+def test_download_read_timeout(fake_line, store, monkeypatch):
+    monkeypatch.setattr(line_client, "LINE_READ_TIMEOUT", 0.2)
+    monkeypatch.setattr(line_client, "LINE_DOWNLOAD_RETRIES", 0)
+    fake_line.latency = 1.0
+    start = time.perf_counter()
+    with pytest.raises(urllib3.exceptions.ReadTimeoutError):
+        line_client.download_content("m-slow", store.stage)
+    assert time.perf_counter() - start < 0.9
+
+
+def test_download_success(fake_line, store):
+    staged = line_client.download_content("m-ok", store.stage)
+    assert staged.size == len(fake_line.images["m-ok"])
+
+
+def test_download_many_returns_failures_in_order(fake_line, store):
+    fake_line.fail_ids.add("m-bad")
+    failures = fake_line.failures
+    downloader = line_client.AsyncDownloader(max_concurrency=4)
+    try:
+        results = downloader.download_many(["m-a", "m-bad", "m-b"], store.astage)
+    finally:
+        downloader.close()
+
+    assert [type(r) for r in results] == [StagedImage, ApiException, StagedImage]
+    assert results[1].status == 500
+    assert fake_line.failures - failures == line_client.LINE_DOWNLOAD_RETRIES + 1
+    assert results[0].size == len(fake_line.images["m-a"])
+    assert results[2].size == len(fake_line.images["m-b"])
+
+
+def download_seconds():
+    series = metrics.stage_seconds._series.get(("download",), [None, 0.0, 0])
+    return series[1], series[2]
+
+
+@pytest.mark.parametrize("path", ["sync", "async"])
+def test_download_metric_excludes_backoff(fake_line, store, monkeypatch, path):
+    monkeypatch.setattr(line_client, "LINE_DOWNLOAD_RETRIES", 1)
+    monkeypatch.setattr(line_client, "backoff", lambda attempt: 0.3)
+    fake_line.fail_ids.add("m-retry")
+    total, count = download_seconds()
+    if path == "sync":
+        with pytest.raises(ApiException):
+            line_client.download_content("m-retry", store.stage)
+    else:
+        downloader = line_client.AsyncDownloader()
+        try:
+            assert isinstance(downloader.download_many(["m-retry"], store.astage)[0], ApiException)
+        finally:
+            downloader.close()
+    after_total, after_count = download_seconds()
+    assert after_count - count == 2
+    assert after_total - total < 0.2
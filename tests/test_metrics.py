@@ -0,0 +1,36 @@
+import pytest
+from werkzeug.exceptions import BadRequest
+
+import app as webapp
+from conftest import make_event, post_events
+
+
+def test_metrics_types():
+    client = webapp.app.test_client()
+    assert post_events(client, make_event()).status_code == 200
+    webapp.event_queue.join()
+    text = client.get("/metrics").get_data(as_text=True)
+
+    assert "# TYPE linebot_stage_seconds histogram" in text
+    assert 'linebot_webhook_requests_total{status="200"}' in text
+    for name in ("linebot_queue_enqueued_total", "linebot_queue_wait_milliseconds_total",
+                 "linebot_dedupe_checked_total", "linebot_dedupe_cache_hits_total"):
+        assert f"# TYPE {name} counter" in text and f"# HELP {name} " in text
+    for name in ("linebot_queue_depth", "linebot_queue_capacity", "linebot_dedupe_cached",
+                 "linebot_dedupe_in_flight", "linebot_dedupe_hit_rate"):
+        assert f"# TYPE {name} gauge" in text
+    assert "linebot_queue_enqueued " not in text
+
+
+def test_profile_route_only_with_profiler():
+    assert not webapp.PROFILER
+    assert "debug_profile" not in webapp.app.view_functions
+    assert webapp.app.test_client().get("/debug/profile").status_code == 404
+
+
+@pytest.mark.parametrize("query", ["seconds=abc", "seconds=nan", "seconds=0", "seconds=61", "interval=-1"])
+def test_profile_args_are_validated(query):
+    with webapp.app.test_request_context("/debug/profile?" + query):
+        with pytest.raises(BadRequest):
+            webapp.float_arg("seconds", 5, 0.01, 60)
+            webapp.float_arg("interval", 0.005, 0.001, 1)
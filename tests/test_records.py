@@ -0,0 +1,67 @@
+import uuid
+
+import pytest
+
+import app as webapp
+import storage
+
+
+def add_records(user_id, *timestamps):
+    storage.save_batch([(user_id, f"t{i}", None, ts) for i, ts in enumerate(timestamps)])
+
+
+def fetch_all(client, **query):
+    ids, cursor = [], None
+    while True:
+        resp = client.get("/api/records", query_string=dict(query, cursor=cursor) if cursor else query)
+        assert resp.status_code == 200
+        data = resp.get_json()
+        ids += [r["id"] for r in data["records"]]
+        cursor = data["next_cursor"]
+        if not cursor:
+            return ids
+
+
+def test_keyset_pages_through_rows_with_the_same_timestamp():
+    user_id = "U" + uuid.uuid4().hex
+    add_records(user_id, *["2024-05-01 10:00:00"] * 7)
+    client = webapp.app.test_client()
+    ids = fetch_all(client, user_id=user_id, limit=2)
+    assert len(ids) == 7 and len(set(ids)) == 7
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_user_and_date_filters_combine():
+    user_id = "U" + uuid.uuid4().hex
+    add_records(user_id, "2024-04-30 23:59:59", "2024-05-01 00:00:00", "2024-05-02 12:00:00",
+                "2024-05-02 23:59:59", "2024-05-03 00:00:00")
+    add_records("U" + uuid.uuid4().hex, "2024-05-02 12:00:00")
+    client = webapp.app.test_client()
+    rows = client.get("/api/records", query_string={"user_id": user_id, "from": "2024-05-01",
+                                                    "to": "2024-05-02"}).get_json()["records"]
+    assert [r["timestamp"] for r in rows] == ["2024-05-02 23:59:59", "2024-05-02 12:00:00", "2024-05-01 00:00:00"]
+    assert {r["user_id"] for r in rows} == {user_id}
+
+
+def test_unchanged_page_is_304_and_changes_with_thumbnails():
+    user_id = "U" + uuid.uuid4().hex
+    storage.save_batch([(user_id, None, f"{user_id}.jpg", "2024-05-01 10:00:00")])
+    client = webapp.app.test_client()
+    for path in ("/", "/api/records"):
+        resp = client.get(path, query_string={"user_id": user_id})
+        assert resp.status_code == 200 and "Last-Modified" not in resp.headers
+        etag = resp.headers["ETag"]
+        again = client.get(path, query_string={"user_id": user_id}, headers={"If-None-Match": etag})
+        assert again.status_code == 304
+
+    # thumbnail ถูกเขียนทีหลังในวินาทีเดียวกัน: ETag ต้องเปลี่ยน
+    storage.set_derivatives(f"{user_id}.jpg", "thumbs/x_320.jpg", None)
+    resp = client.get("/api/records", query_string={"user_id": user_id}, headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+
+
+@pytest.mark.parametrize("query", [{"cursor": "zzz"}, {"from": "bad"}, {"to": "2024-13-01"}, {"limit": "x"}])
+def test_bad_query_is_400(query):
+    client = webapp.app.test_client()
+    assert client.get("/api/records", query_string=query).status_code == 400
+    assert client.get("/", query_string=query).status_code == 400
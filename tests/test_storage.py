@@ -0,0 +1,72 @@
+import concurrent.futures, sqlite3, threading
+
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "batch.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (x INTEGER UNIQUE)")
+    return path
+
+
+def values(path):
+    return sorted(r[0] for r in sqlite3.connect(path).execute("SELECT x FROM t"))
+
+
+def insert(x):
+    return lambda conn: conn.execute("INSERT INTO t (x) VALUES (?)", (x,)).lastrowid
+
+
+def test_failing_unit_does_not_fail_its_batch(db_path):
+    batcher = storage.CommitBatcher(path=db_path)
+    gate = threading.Event()
+    blocker = batcher.submit_unit(lambda conn: gate.wait(5))
+
+    def half_written(conn):
+        conn.execute("INSERT INTO t (x) VALUES (2)")
+        raise ValueError("bad unit")
+
+    # ทั้งสามงานเข้าคิวระหว่างที่ writer ติดอยู่กับ blocker จึงถูก commit เป็น batch เดียวกัน
+    futures = [batcher.submit_unit(insert(1)), batcher.submit_unit(half_written), batcher.submit(
+        "INSERT INTO t (x) VALUES (?)", (3,))]
+    gate.set()
+    assert blocker.result(5)
+    assert futures[0].result(5) and futures[2].result(5)
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert values(db_path) == [1, 3]
+
+
+def test_writer_restarts_after_dying(db_path, monkeypatch):
+    batcher = storage.CommitBatcher(path=db_path)
+    connect = storage.connect
+    calls = []
+
+    def flaky_connect(path=None):
+        calls.append(path)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return connect(path)
+
+    monkeypatch.setattr(storage, "connect", flaky_connect)
+    with pytest.raises(sqlite3.OperationalError):
+        batcher.submit_unit(insert(1)).result(5)
+    assert batcher.submit_unit(insert(2)).result(5)
+    assert len(calls) == 2
+    assert values(db_path) == [2]
+
+
+def test_write_unit_times_out(db_path, monkeypatch):
+    gate = threading.Event()
+    monkeypatch.setattr(storage, "batcher", storage.CommitBatcher(path=db_path))
+    monkeypatch.setattr(storage, "DB_WRITE_TIMEOUT", 0.1)
+    storage.batcher.submit_unit(lambda conn: gate.wait(5))
+    try:
+        with pytest.raises(concurrent.futures.TimeoutError):
+            storage.write_unit(insert(1))
+    finally:
+        gate.set()
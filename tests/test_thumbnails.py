@@ -0,0 +1,57 @@
+import os, time, uuid
+
+from PIL import Image
+
+import app as webapp
+import storage
+import thumbnails
+from conftest import WORKDIR
+
+
+def add_record(user_id, image_path):
+    storage.save_batch([(user_id, None, image_path, time.strftime("%Y-%m-%d %H:%M:%S"))])
+
+
+def thumbs_of(user_id, *paths, timeout=10):
+    # on_done/on_failed ทำงานใน callback ของ future หลัง wait() คืนค่า: รอจน path ที่ส่งไปมีผลครบ
+    deadline = time.monotonic() + timeout
+    while True:
+        rows, _ = storage.query_records(user_id=user_id)
+        found = {r[3]: r[5] for r in rows}
+        if all(found.get(p) is not None for p in paths) or time.monotonic() > deadline:
+            return found
+        time.sleep(0.05)
+
+
+def test_dashboard_backfill_marks_failures_once(monkeypatch):
+    monkeypatch.setattr(thumbnails, "THUMBNAILS", True)
+    user_id = "U" + uuid.uuid4().hex
+    good = os.path.join(WORKDIR, f"{user_id}-good.jpg")
+    broken = os.path.join(WORKDIR, f"{user_id}-broken.jpg")
+    missing = os.path.join(WORKDIR, f"{user_id}-missing.jpg")
+    Image.new("RGB", (800, 600), "red").save(good, "JPEG")
+    with open(broken, "wb") as f:
+        f.write(b"not a jpeg")
+    for path in (good, broken, missing):
+        add_record(user_id, path)
+
+    submitted = []
+    submit = webapp.thumbnail_pipeline.submit
+    monkeypatch.setattr(webapp.thumbnail_pipeline, "submit", lambda p: (submitted.append(p), submit(p)))
+    client = webapp.app.test_client()
+
+    assert client.get("/", query_string={"user_id": user_id}).status_code == 200
+    assert sorted(submitted) == sorted([good, broken])
+    webapp.thumbnail_pipeline.wait()
+    found = thumbs_of(user_id, good, broken)
+    assert found[good] and os.path.isfile(found[good])
+    assert found[broken] == storage.THUMB_FAILED
+    assert found[missing] is None
+
+    # เปิดหน้าเดิมอีกครั้ง: ไม่ส่งรูปที่เคยล้มเหลวหรือไฟล์หายเข้า pool ซ้ำ
+    submitted.clear()
+    html = client.get("/", query_string={"user_id": user_id}).get_data(as_text=True)
+    assert submitted == []
+    assert 'src="/thumbs/' in html
+    resp = client.get("/thumbs/" + os.path.relpath(found[good], thumbnails.THUMB_DIR))
+    assert resp.status_code == 200 and resp.mimetype == "image/jpeg"
@@ -0,0 +1,107 @@
+import os, time, hashlib, threading, logging, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from image_store import content_hash
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# สร้าง thumbnail นอก request path ใน process pool แล้วเก็บ path ลง DB
+THUMBNAILS = os.getenv("THUMBNAILS", "1") == "1"
+THUMB_DIR = os.getenv("THUMB_DIR", "thumbs")
+THUMB_SIZE = int(os.getenv("THUMB_SIZE", "320"))
+THUMB_QUALITY = int(os.getenv("THUMB_QUALITY", "80"))
+THUMB_WEBP = os.getenv("THUMB_WEBP", "1") == "1"
+THUMB_WORKERS = int(os.getenv("THUMB_WORKERS", "2"))
+
+
+def derivative_base(src_path, thumb_dir=THUMB_DIR, size=THUMB_SIZE):
+    # ไฟล์ใน store เป็น content-addressed อยู่แล้ว ส่วนไฟล์แบบเก่าใช้ hash ของ path แทน
+    key = content_hash(src_path) or hashlib.sha256(src_path.encode()).hexdigest()
+    return os.path.join(thumb_dir, key[:2], key[2:4], f"{key}_{size}")
+
+
+def _save_atomic(im, path, fmt, quality):
+    tmp = f"{path}.{os.getpid()}.part"
+    im.save(tmp, fmt, quality=quality)
+    os.replace(tmp, path)
+
+
+def render_derivatives(src_path, thumb_dir=THUMB_DIR, size=THUMB_SIZE, quality=THUMB_QUALITY, webp=THUMB_WEBP):
+    """Runs in a pool process; returns (thumb_path, webp_path or None)."""
+    base = derivative_base(src_path, thumb_dir, size)
+    thumb_path = base + ".jpg"
+    webp_path = base + ".webp" if webp else None
+    if os.path.exists(thumb_path) and (webp_path is None or os.path.exists(webp_path)):
+        return thumb_path, webp_path
+
+    from PIL import Image, ImageOps
+
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    with Image.open(src_path) as im:
+        im.draft("RGB", (size, size))  # JPEG: ให้ decoder ย่อขนาดตั้งแต่ตอน decode
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        im.thumbnail((size, size))
+        _save_atomic(im, thumb_path, "JPEG", quality)
+        if webp_path:
+            _save_atomic(im, webp_path, "WEBP", quality)
+    return thumb_path, webp_path
+
+
+class ThumbnailPipeline:
+    def __init__(self, on_done, on_failed=None, workers=THUMB_WORKERS):
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.workers = workers
+        self._pool = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            # ห้าม fork จาก worker ที่มี thread วิ่งอยู่ (db-writer, line-async, ...) เพราะ lock ที่ค้างจะ deadlock ใน process ลูก
+            # forkserver fork จาก process สะอาดที่ import แค่ module นี้ไว้
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload([__name__])
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        return self._pool
+
+    def submit(self, src_path):
+        if not THUMBNAILS or not src_path or src_path.startswith("s3://"):
+            return
+        with self._lock:
+            if src_path in self._pending:
+                return
+            try:
+                fut = self._get_pool().submit(render_derivatives, src_path)
+            except BrokenProcessPool:
+                # process ลูกตาย (เช่น OOM ตอน decode รูปใหญ่): สร้าง pool ใหม่แล้วลองอีกครั้ง
+                self._pool = None
+                fut = self._get_pool().submit(render_derivatives, src_path)
+            self._pending[src_path] = fut
+        submitted = time.perf_counter()
+        fut.add_done_callback(lambda f: self._done(src_path, f, submitted))
+
+    def wait(self):
+        with self._lock:
+            futures = list(self._pending.values())
+        wait(futures)
+
+    def _done(self, src_path, fut, submitted):
+        with self._lock:
+            self._pending.pop(src_path, None)
+        metrics.stage_seconds.observe(time.perf_counter() - submitted, "thumbnail")
+        try:
+            thumb_path, webp_path = fut.result()
+        except Exception:
+            metrics.errors_total.inc("thumbnail")
+            logger.exception("🔥 Thumbnail error", extra={"image_path": src_path})
+            thumb_path = webp_path = None
+        try:
+            if thumb_path:
+                self.on_done(src_path, thumb_path, webp_path)
+            elif self.on_failed:
+                self.on_failed(src_path)
+        except Exception:
+            logger.exception("🔥 Thumbnail update error", extra={"image_path": src_path})